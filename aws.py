@@ -0,0 +1,106 @@
+"""
+Shared AWS clients and S3 helpers - clients are resolved once per process
+and reused by every task
+"""
+
+from functools import lru_cache
+import threading
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from prefect_aws import AwsCredentials
+
+from config import BUCKET, S3_MAX_CONCURRENCY
+
+MAX_WORKERS = S3_MAX_CONCURRENCY
+DELETE_BATCH_SIZE = 1000  # S3 DeleteObjects limit
+LIST_PAGE_SIZE = 1000
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+# Images are a few MB, so almost every copy is a single CopyObject; anything
+# past 64MB is split into 16MB UploadPartCopy parts, 10 at a time
+COPY_CONFIG = TransferConfig(
+    multipart_threshold=64 * 1024 * 1024,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=10,
+    use_threads=True
+)
+
+# Throttling and transient errors are retried per request with token-bucket
+# backoff, rather than re-running whole tasks at the Prefect level
+RETRIES = {'mode': 'adaptive', 'max_attempts': 10}
+
+S3_CONFIG = Config(
+    # One pooled connection per worker so requests never queue for a socket
+    max_pool_connections=S3_MAX_CONCURRENCY,
+    retries=RETRIES,
+    # Keep idle pooled connections alive so they are reused, not re-handshaked
+    tcp_keepalive=True,
+    # Bucket-in-hostname requests go straight to the bucket's region
+    s3={'addressing_style': 'virtual'}
+)
+
+# Caps in-flight S3 requests across every pool in the process (task runner
+# threads, copy/download pools and s3transfer's own workers alike)
+_S3_SLOTS = threading.BoundedSemaphore(S3_MAX_CONCURRENCY)
+_slot_held = threading.local()
+
+
+def _acquire_s3_slot(**kwargs):
+    """Wait for a free request slot before each S3 attempt is sent"""
+    if not getattr(_slot_held, 'value', False):
+        _S3_SLOTS.acquire()
+        _slot_held.value = True
+
+
+def _release_s3_slot(**kwargs):
+    """Free the slot once the attempt has a response or an error (retry waits don't hold it)"""
+    if getattr(_slot_held, 'value', False):
+        _slot_held.value = False
+        _S3_SLOTS.release()
+
+
+@lru_cache(maxsize=1)
+def get_aws_credentials():
+    """Load the AWS credentials block once per process"""
+    return AwsCredentials.load("my-aws-creds")
+
+
+@lru_cache(maxsize=1)
+def get_s3_client():
+    """Shared S3 client; boto3 clients are thread-safe and reuse connections"""
+    session = get_aws_credentials().get_boto3_session()
+    s3 = session.client("s3", config=S3_CONFIG)
+    s3.meta.events.register('before-send.s3', _acquire_s3_slot)
+    s3.meta.events.register('response-received.s3', _release_s3_slot)
+    # Errors raised after the send (response parsing, checksums) skip
+    # response-received, so release there too; releasing twice is a no-op
+    s3.meta.events.register('after-call-error.s3', _release_s3_slot)
+    return s3
+
+
+@lru_cache(maxsize=1)
+def get_sqs_client():
+    """Shared SQS client for the simulation pool event queue"""
+    session = get_aws_credentials().get_boto3_session()
+    return session.client("sqs", config=Config(retries=RETRIES))
+
+
+def copy_key(s3, source_key, dest_key):
+    """Server-side copy that switches to multipart UploadPartCopy for large objects"""
+    s3.copy(
+        {'Bucket': BUCKET, 'Key': source_key},
+        BUCKET,
+        dest_key,
+        Config=COPY_CONFIG
+    )
+
+
+def delete_keys(s3, objects):
+    """Delete objects in DeleteObjects-sized chunks"""
+    for i in range(0, len(objects), DELETE_BATCH_SIZE):
+        # Quiet mode only reports failures, keeping the response small
+        response = s3.delete_objects(
+            Bucket=BUCKET,
+            Delete={'Objects': objects[i:i + DELETE_BATCH_SIZE], 'Quiet': True}
+        )
+        for error in response.get('Errors', []):
+            print(f"Error deleting {error['Key']}: {error.get('Message')}")
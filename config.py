@@ -1,9 +1,31 @@
 from dotenv import load_dotenv
+from typing import Final, Optional
 import os
 
-load_dotenv()
+# Child processes inherit the loaded environment, so only read .env once
+if not os.getenv('PREFECT_FLOWS_DOTENV_LOADED'):
+    load_dotenv()
+    os.environ['PREFECT_FLOWS_DOTENV_LOADED'] = '1'
 
-BUCKET = 'smoke-fire-detection-bucket'
-BATCH_SIZE = 10
-INCOMING_PREFIX = 'datasets/incoming/raw/'
-PROCESSED_PREFIX = 'datasets/incoming/processed/'
+
+def _positive_int(name: str, default: int) -> int:
+    value = int(os.getenv(name, str(default)))
+    if value <= 0:
+        raise ValueError(f"{name} must be a positive integer, got {value}")
+    return value
+
+
+BUCKET: Final[str] = os.getenv('BUCKET', 'smoke-fire-detection-bucket')
+BATCH_SIZE: Final[int] = _positive_int('BATCH_SIZE', 10)
+INCOMING_PREFIX: Final[str] = 'datasets/incoming/raw/'
+PROCESSED_PREFIX: Final[str] = 'datasets/incoming/processed/'
+# One JSON file per incoming batch listing its (hash-sharded) image and label keys
+INCOMING_MANIFEST_PREFIX: Final[str] = 'datasets/incoming/manifests/'
+
+# Process-wide cap on in-flight S3 requests, shared by every thread pool
+# (enforced in aws.py), and the size of the S3 client's connection pool
+S3_MAX_CONCURRENCY: Final[int] = _positive_int('S3_MAX_CONCURRENCY', 64)
+
+# SQS queue fed by S3 event notifications on datasets/simulation_pool/images/.
+# When set, the daily upload dequeues new images instead of listing the pool.
+SIM_POOL_QUEUE_URL: Final[Optional[str]] = os.getenv('SIM_POOL_QUEUE_URL') or None
@@ -2,121 +2,352 @@
 Daily batch upload - moves images from simulation_pool to incoming
 """
 
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
-from pathlib import Path
+from urllib.parse import unquote_plus
+import hashlib
+import json
+from botocore.exceptions import ClientError
 from prefect import task, flow
-from prefect_aws.credentials import AwsCredentials
 
+from aws import (
+    IMAGE_EXTENSIONS,
+    LIST_PAGE_SIZE,
+    MAX_WORKERS,
+    copy_key,
+    delete_keys,
+    get_s3_client,
+    get_sqs_client
+)
 from config import BATCH_SIZE
 from config import BUCKET
+from config import INCOMING_MANIFEST_PREFIX
+from config import INCOMING_PREFIX
+from config import SIM_POOL_QUEUE_URL
 
+SQS_BATCH_SIZE = 10  # ReceiveMessage / DeleteMessageBatch limit
 
-@task(retries=1)
+
+def shard_for(name):
+    """Two hex digits from the file name, spreading incoming writes over 256 prefixes"""
+    return hashlib.blake2b(name.encode(), digest_size=1).hexdigest()
+
+
+def delete_messages(sqs, receipt_handles):
+    """Delete SQS messages in DeleteMessageBatch-sized chunks"""
+    receipt_handles = list(dict.fromkeys(receipt_handles))
+    for i in range(0, len(receipt_handles), SQS_BATCH_SIZE):
+        chunk = receipt_handles[i:i + SQS_BATCH_SIZE]
+        response = sqs.delete_message_batch(
+            QueueUrl=SIM_POOL_QUEUE_URL,
+            Entries=[
+                {'Id': str(n), 'ReceiptHandle': handle}
+                for n, handle in enumerate(chunk)
+            ]
+        )
+        # Unacknowledged messages come back after the visibility timeout
+        for failure in response.get('Failed', []):
+            print(f"Error deleting message {failure['Id']}: {failure.get('Code')} {failure.get('Message', '')}")
+
+
+def _split_key(lo, hi):
+    """Return a key strictly between lo and hi (None means unbounded), if any"""
+    bounded = hi is not None
+    for i in range(len(lo) + 1):
+        # Printable ASCII: 31 sorts below ' ', 127 above '~'
+        c_lo = ord(lo[i]) if i < len(lo) else 31
+        c_hi = ord(hi[i]) if bounded and i < len(hi) else 127
+        if c_hi - c_lo > 1:
+            return lo[:i] + chr((c_lo + c_hi) // 2)
+        if c_hi != c_lo:
+            bounded = False
+    return None
+
+
+def _list_range(s3, prefix, start, end):
+    """List one page of keys in (start, end] and return any ranges left over"""
+    response = s3.list_objects_v2(
+        Bucket=BUCKET,
+        Prefix=prefix,
+        StartAfter=start,
+        MaxKeys=LIST_PAGE_SIZE
+    )
+    contents = response.get('Contents', [])
+    keys = [obj['Key'] for obj in contents if end is None or obj['Key'] <= end]
+
+    # A full page that stops short of end means the range needs more listing
+    if not response.get('IsTruncated') or len(keys) < len(contents):
+        return keys, []
+
+    last = keys[-1]
+    if last == end:
+        return keys, []
+
+    # Every range boundary shares the prefix, so only split what follows it
+    middle = _split_key(
+        last[len(prefix):],
+        end[len(prefix):] if end is not None else None
+    )
+    if middle is None:
+        return keys, [(last, end)]
+    return keys, [(last, prefix + middle), (prefix + middle, end)]
+
+
+def _iter_ranges(s3, prefix, concurrency):
+    """Yield the key list of each listed range as bisection completes it"""
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = {executor.submit(_list_range, s3, prefix, prefix, None)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                range_keys, remaining = future.result()
+                yield range_keys
+                pending |= {
+                    executor.submit(_list_range, s3, prefix, start, end)
+                    for start, end in remaining
+                }
+
+
+def parallel_count(s3, prefix, concurrency=MAX_WORKERS):
+    """Count objects under prefix, bisecting the key space across threads
+
+    list_objects_v2 pagination is serial (each page needs the previous
+    continuation token), so instead each full page splits the remaining key
+    range in two and both halves are listed concurrently.
+    """
+    return sum(
+        sum(1 for key in range_keys if not key.endswith('/'))
+        for range_keys in _iter_ranges(s3, prefix, concurrency)
+    )
+
+
+def count_keys(s3, prefix):
+    """Count objects directly from each page's KeyCount, skipping the folder marker"""
+    paginator = s3.get_paginator('list_objects_v2')
+    pages = paginator.paginate(
+        Bucket=BUCKET,
+        Prefix=prefix,
+        StartAfter=prefix,
+        PaginationConfig={'PageSize': LIST_PAGE_SIZE}
+    )
+    return sum(page.get('KeyCount', 0) for page in pages)
+
+
+@task
 def get_available_images(limit=BATCH_SIZE):
     """Get next batch of images from simulation pool"""
-    aws_credentials = AwsCredentials.load("my-aws-creds")
-    session = aws_credentials.get_boto3_session()
-    s3 = session.client("s3")
+    s3 = get_s3_client()
     
-    response = s3.list_objects_v2(
+    paginator = s3.get_paginator('list_objects_v2')
+    pages = paginator.paginate(
         Bucket=BUCKET,
         Prefix='datasets/simulation_pool/images/',
-        MaxKeys=limit * 2
+        PaginationConfig={'PageSize': LIST_PAGE_SIZE}
     )
     
-    if 'Contents' not in response:
-        return []
-    
+    # Stop listing as soon as enough images are found
     images = []
-    for obj in response['Contents']:
-        key = obj['Key']
-        if not key.endswith('/') and key.lower().endswith(('.jpg', '.jpeg', '.png')):
-            images.append(key)
-            if len(images) >= limit:
-                break
+    for page in pages:
+        for obj in page.get('Contents', []):
+            key = obj['Key']
+            if not key.endswith('/') and key.lower().endswith(IMAGE_EXTENSIONS):
+                images.append(key)
+                if len(images) >= limit:
+                    return images
     
     return images
 
 
-@task(retries=2)
+@task
+def receive_pool_images(limit=BATCH_SIZE):
+    """Get next batch of images from the simulation pool's S3 event queue
+
+    Returns {image_key: [receipt_handle, ...]}. Messages stay invisible until the
+    queue's visibility timeout expires, so anything not acknowledged with
+    ack_pool_messages is redelivered on a later run.
+    """
+    sqs = get_sqs_client()
+    
+    images = {}
+    ignored = []
+    while len(images) < limit:
+        response = sqs.receive_message(
+            QueueUrl=SIM_POOL_QUEUE_URL,
+            MaxNumberOfMessages=min(SQS_BATCH_SIZE, limit - len(images)),
+            WaitTimeSeconds=1
+        )
+        messages = response.get('Messages', [])
+        if not messages:
+            break
+        
+        for message in messages:
+            # S3 event keys are URL-encoded; test events have no Records, and
+            # only creations are new images (not deletions, restores, ...)
+            records = json.loads(message['Body']).get('Records', [])
+            keys = [
+                unquote_plus(r['s3']['object']['key']) for r in records
+                if r.get('eventName', '').startswith('ObjectCreated')
+            ]
+            keys = [k for k in keys if k.lower().endswith(IMAGE_EXTENSIONS)]
+            if not keys:
+                ignored.append(message['ReceiptHandle'])
+            for key in keys:
+                # Delivery is at-least-once, so one key can arrive in several messages
+                images.setdefault(key, []).append(message['ReceiptHandle'])
+    
+    delete_messages(sqs, ignored)
+    return images
+
+
+@task
+def ack_pool_messages(receipt_handles):
+    """Remove handled messages from the simulation pool queue"""
+    delete_messages(get_sqs_client(), receipt_handles)
+
+
+@task
 def move_batch(image_keys):
-    """Move images and labels to incoming"""
+    """Move images and labels to incoming
+
+    Returns (moved image keys, image keys no longer in the pool).
+
+    Files are spread over hash-sharded prefixes so a batch is not throttled
+    as a single S3 prefix; the batch manifest records where each one went.
+    """
     if not image_keys:
-        return 0
+        return [], []
     
-    aws_credentials = AwsCredentials.load("my-aws-creds")
-    session = aws_credentials.get_boto3_session()
-    s3 = session.client("s3")
+    s3 = get_s3_client()
 
     batch_id = datetime.now().strftime("%Y%m%d_%H%M%S")
-    moved = 0
-    
-    for image_key in image_keys:
+
+    def _copy_one(image_key):
+        """Copy an image (and its label) and return the (source, destination) pairs
+
+        An empty list means the image is already gone from the pool; None
+        means the copy failed and should be retried on a later run.
+        """
+        copied = []
         try:
-            image_name = Path(image_key).name
-            image_stem = Path(image_key).stem
+            image_name = image_key.rsplit('/', 1)[-1]
+            image_stem = image_name.rsplit('.', 1)[0]
             
-            new_image_key = f'datasets/incoming/raw/batch_{batch_id}/images/{image_name}'
-            new_label_key = f'datasets/incoming/raw/batch_{batch_id}/labels/{image_stem}.txt'
+            # The label shares its image's shard
+            batch_prefix = f'{INCOMING_PREFIX}{shard_for(image_name)}/batch_{batch_id}/'
+            new_image_key = f'{batch_prefix}images/{image_name}'
+            new_label_key = f'{batch_prefix}labels/{image_stem}.txt'
             
-            # Copy and delete image
-            s3.copy_object(
-                Bucket=BUCKET,
-                CopySource={'Bucket': BUCKET, 'Key': image_key},
-                Key=new_image_key
-            )
-            s3.delete_object(Bucket=BUCKET, Key=image_key)
-            print(f"- Moved image: {image_name}")
+            # Copy image
+            try:
+                copy_key(s3, image_key, new_image_key)
+            except ClientError as e:
+                if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+                    raise
+                print(f"- (No longer in pool: {image_name})")
+                return []
+            copied.append((image_key, new_image_key))
+            print(f"- Copied image: {image_name}")
 
             # Try to move label
             label_key = image_key.replace('/images/', '/labels/').rsplit('.', 1)[0] + '.txt'
             try:
-                s3.copy_object(
-                    Bucket=BUCKET,
-                    CopySource={'Bucket': BUCKET, 'Key': label_key},
-                    Key=new_label_key
-                )
-                s3.delete_object(Bucket=BUCKET, Key=label_key)
-                print(f"- Moved label: {image_stem}.txt")
-            except s3.exceptions.NoSuchKey:
+                copy_key(s3, label_key, new_label_key)
+                copied.append((label_key, new_label_key))
+                print(f"- Copied label: {image_stem}.txt")
+            except ClientError as e:
+                # copy() checks the source with HeadObject, which reports a 404
+                if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+                    raise
                 print("- (No label found)")
-                pass
             
-            moved += 1
+            return copied
             
         except Exception as e:
-            print(f"Error moving {Path(image_key).name}: {e}")
-            continue
+            print(f"Error moving {image_key.rsplit('/', 1)[-1]}: {e}")
+            # Nothing lists shard folders, so copies that will not reach the
+            # manifest are removed; the original stays in the pool for next time
+            try:
+                delete_keys(s3, [{'Key': dest} for _, dest in copied])
+            except Exception as cleanup_error:
+                print(f"Error removing partial copy of {image_key.rsplit('/', 1)[-1]}: {cleanup_error}")
+            return None
+
+    # S3 calls are latency-bound, so overlap them across a shared client
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        outcomes = list(executor.map(_copy_one, image_keys))
+    missing = [key for key, r in zip(image_keys, outcomes) if r == []]
+    results = [r for r in outcomes if r]
+    if not results:
+        return [], missing
+
+    # Downstream reads the batch from its manifest instead of listing every shard.
+    # It is written before the originals go, so a failure here leaves them in the pool.
+    manifest = {
+        'images': [copied[0][1] for copied in results],
+        'labels': [dest for copied in results for _, dest in copied[1:]]
+    }
+    try:
+        s3.put_object(
+            Bucket=BUCKET,
+            Key=f'{INCOMING_MANIFEST_PREFIX}batch_{batch_id}.json',
+            Body=json.dumps(manifest).encode(),
+            ContentType='application/json'
+        )
+    except Exception:
+        # Nothing lists shard folders, so copies without a manifest would be
+        # orphaned; drop them and let the next run move the originals again
+        delete_keys(s3, [{'Key': dest} for copied in results for _, dest in copied])
+        raise
+
+    # Only delete originals whose copy succeeded, in batched requests
+    to_delete = [{'Key': source} for copied in results for source, _ in copied]
+    delete_keys(s3, to_delete)
     
-    return moved
+    # The image is always the first pair of each copied group
+    return [copied[0][0] for copied in results], missing
 
 
 @task
 def get_stats():
     """Get counts from pool and incoming"""
-    aws_credentials = AwsCredentials.load("my-aws-creds")
-    session = aws_credentials.get_boto3_session()
-    s3 = session.client("s3")
+    s3 = get_s3_client()
     
     # Count remaining in pool
     try:
-        response = s3.list_objects_v2(
-            Bucket=BUCKET,
-            Prefix='datasets/simulation_pool/images/'
-        )
-        pool_count = len([obj for obj in response.get('Contents', []) 
-                         if not obj['Key'].endswith('/')])
+        pool_count = parallel_count(s3, 'datasets/simulation_pool/images/')
     except:
         pool_count = 0
     
-    # Count in incoming
+    # Count in incoming: sharded batches from their manifests, and any older
+    # unsharded batch_ folders from their images/ sub-folder's KeyCount
     try:
-        response = s3.list_objects_v2(
+        paginator = s3.get_paginator('list_objects_v2')
+        manifest_keys = [
+            obj['Key']
+            for page in paginator.paginate(Bucket=BUCKET, Prefix=INCOMING_MANIFEST_PREFIX)
+            for obj in page.get('Contents', [])
+            if obj['Key'].endswith('.json')
+        ]
+        pages = paginator.paginate(
             Bucket=BUCKET,
-            Prefix='datasets/incoming/raw/'
+            Prefix=INCOMING_PREFIX,
+            Delimiter='/'
         )
-        incoming_count = len([obj for obj in response.get('Contents', []) 
-                             if not obj['Key'].endswith('/') and 'images/' in obj['Key']])
+        image_prefixes = [
+            f"{common_prefix['Prefix']}images/"
+            for page in pages
+            for common_prefix in page.get('CommonPrefixes', [])
+            if common_prefix['Prefix'][len(INCOMING_PREFIX):].startswith('batch_')
+        ]
+
+        def _manifest_images(key):
+            body = s3.get_object(Bucket=BUCKET, Key=key)['Body'].read()
+            return len(json.loads(body)['images'])
+
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            incoming_count = sum(executor.map(_manifest_images, manifest_keys)) + sum(
+                executor.map(lambda prefix: count_keys(s3, prefix), image_prefixes)
+            )
     except:
         incoming_count = 0
     
@@ -129,13 +360,25 @@ def daily_batch_upload():
     print("\n" + "="*60)
     print(f"DAILY BATCH UPLOAD - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print("="*60)
-    images = get_available_images(BATCH_SIZE)
+    if SIM_POOL_QUEUE_URL:
+        # New pool objects arrive as S3 events, so no pool listing is needed
+        queued = receive_pool_images(BATCH_SIZE)
+        images = list(queued)
+    else:
+        images = get_available_images(BATCH_SIZE)
     
     if not images:
         print("No images available")
         return {"status": "no_images", "moved": 0}
     
-    moved = move_batch(images)
+    moved_keys, missing_keys = move_batch(images)
+    if SIM_POOL_QUEUE_URL:
+        # Events for images that are already gone are done with too; left
+        # unacknowledged they would be redelivered and fill every later batch
+        ack_pool_messages([
+            handle for key in moved_keys + missing_keys for handle in queued[key]
+        ])
+    moved = len(moved_keys)
     pool_remaining, incoming_total = get_stats()
     
 
@@ -1,8 +1,17 @@
+from concurrent.futures import ThreadPoolExecutor
 from prefect import flow, task, get_run_logger
 import mlflow
 from mlflow import MlflowClient
 from prefect.blocks.system import Secret
 
+# (metric key, display label, minimum improvement, required)
+THRESHOLDS = (
+    ('metrics/mAP50-95B', 'mAP50-95', 0.02, True),
+    ('metrics/mAP50B', 'mAP50', 0.02, False),
+    ('metrics/precisionB', 'Precision', 0.01, False),
+    ('metrics/recallB', 'Recall', 0.01, False),
+)
+
 @task
 def get_mlflow_client():
     tracking_uri = Secret.load("mlflow-server").get()
@@ -10,9 +19,12 @@ def get_mlflow_client():
     return MlflowClient()
 
 @task
-def get_latest_metrics_for_run(client: MlflowClient, run_id: str) -> dict:
-    run = client.get_run(run_id)
-    return dict(run.data.metrics)
+def get_latest_metrics_for_runs(client: MlflowClient, run_ids: list) -> dict:
+    """Fetch the metrics of several runs, issuing the get_run calls concurrently."""
+    run_ids = list(dict.fromkeys(run_ids))
+    with ThreadPoolExecutor(max_workers=len(run_ids)) as executor:
+        runs = executor.map(client.get_run, run_ids)
+        return {run_id: dict(run.data.metrics) for run_id, run in zip(run_ids, runs)}
 
 @task
 def get_production_run_info(client: MlflowClient, model_name: str):
@@ -30,6 +42,15 @@ def get_staging_run_info(client: MlflowClient, model_name: str):
     staging_mv = latest[0]
     return staging_mv.run_id, staging_mv.version
 
+@task
+def get_model_version_for_run(client: MlflowClient, model_name: str, run_id: str):
+    """Look up the registered version (and its stage) created from run_id."""
+    versions = client.search_model_versions(f"name='{model_name}' and run_id='{run_id}'")
+    if not versions:
+        return None, None
+    mv = versions[0]
+    return mv.version, mv.current_stage
+
 @task
 def print_and_compare_metrics(
     incoming_metrics: dict,
@@ -42,46 +63,30 @@ def print_and_compare_metrics(
     """
     logger = get_run_logger()
     logger.info("\nComparison (incoming vs production):")
-    all_keys = set(incoming_metrics.keys()) | set(prod_metrics.keys())
-    for k in sorted(all_keys):
+    for k in sorted(incoming_metrics.keys() | prod_metrics.keys()):
         inc = incoming_metrics.get(k)
         prod = prod_metrics.get(k)
         logger.info(f"  {k}: incoming={inc} | production={prod}")
 
-    # Extract key metrics
-    inc_map50_95 = incoming_metrics.get('metrics/mAP50-95B', 0.0)
-    prod_map50_95 = prod_metrics.get('metrics/mAP50-95B', 0.0)
-    inc_map50 = incoming_metrics.get('metrics/mAP50B', 0.0)
-    prod_map50 = prod_metrics.get('metrics/mAP50B', 0.0)
-    inc_precision = incoming_metrics.get('metrics/precisionB', 0.0)
-    prod_precision = prod_metrics.get('metrics/precisionB', 0.0)
-    inc_recall = incoming_metrics.get('metrics/recallB', 0.0)
-    prod_recall = prod_metrics.get('metrics/recallB', 0.0)
-    
-    # Calculate improvements
-    map50_95_diff = inc_map50_95 - prod_map50_95
-    map50_diff = inc_map50 - prod_map50
-    precision_diff = inc_precision - prod_precision
-    recall_diff = inc_recall - prod_recall
-    
-    # Check thresholds
-    map50_95_passed = map50_95_diff >= 0.02
-    map50_passed = map50_diff >= 0.02
-    precision_passed = precision_diff >= 0.01
-    recall_passed = recall_diff >= 0.01
-    
     logger.info(f"\n⭐️ Model Comparison (Production vs Incoming)")
-    logger.info(f"mAP50-95:  {prod_map50_95:.4f} → {inc_map50_95:.4f} ({map50_95_diff:+.4f}) {'✅' if map50_95_passed else '❌'}")
-    logger.info(f"mAP50:     {prod_map50:.4f} → {inc_map50:.4f} ({map50_diff:+.4f}) {'✅' if map50_passed else '❌'}")
-    logger.info(f"Precision: {prod_precision:.4f} → {inc_precision:.4f} ({precision_diff:+.4f}) {'✅' if precision_passed else '❌'}")
-    logger.info(f"Recall:    {prod_recall:.4f} → {inc_recall:.4f} ({recall_diff:+.4f}) {'✅' if recall_passed else '❌'}")
+    passed = {}
+    for key, label, threshold, _ in THRESHOLDS:
+        # A missing metric must not read as 0.0 and pass as an improvement
+        if key not in incoming_metrics or key not in prod_metrics:
+            raise ValueError(f"Metric '{key}' missing from incoming or production run")
+        inc = incoming_metrics[key]
+        prod = prod_metrics[key]
+        diff = inc - prod
+        passed[key] = diff >= threshold
+        logger.info(f"{label + ':':<10} {prod:.4f} → {inc:.4f} ({diff:+.4f}) {'✅' if passed[key] else '❌'}")
     
     # Decision: mAP50-95 must improve by 2% AND at least one other metric improves
-    other_metric_passed = map50_passed or precision_passed or recall_passed
-    should_promote = map50_95_passed and other_metric_passed
+    required_passed = all(passed[key] for key, _, _, required in THRESHOLDS if required)
+    other_metric_passed = any(passed[key] for key, _, _, required in THRESHOLDS if not required)
+    should_promote = required_passed and other_metric_passed
     
     logger.info(f"\n⭐️ Threshold: mAP50-95 ≥+2% AND (mAP50 ≥+2% OR Precision ≥+1% OR Recall ≥+1%)")
-    logger.info(f"   mAP50-95 requirement: {'✅ PASS' if map50_95_passed else '❌ FAIL'}")
+    logger.info(f"   mAP50-95 requirement: {'✅ PASS' if required_passed else '❌ FAIL'}")
     logger.info(f"   Other metric requirement: {'✅ PASS' if other_metric_passed else '❌ FAIL'}")
     logger.info(f"\n{'✅ PROMOTE TO PRODUCTION' if should_promote else '❌ DO NOT PROMOTE'}")
     
@@ -91,18 +96,12 @@ def print_and_compare_metrics(
 def promote_model_to_production(
     client: MlflowClient,
     incoming_run_id: str,
+    incoming_version: int | None,
     model_name: str,
     current_prod_version: int
 ):
     """Promote the incoming model to production and archive the current production model."""
     logger = get_run_logger()
-    all_versions = client.search_model_versions(f"name='{model_name}'")
-    incoming_version = None
-    
-    for mv in all_versions:
-        if mv.run_id == incoming_run_id:
-            incoming_version = mv.version
-            break
     
     if incoming_version is None:
         raise ValueError(f"Could not find model version for run_id {incoming_run_id}")
@@ -155,11 +154,15 @@ def evaluate_pipeline(
     if incoming_run_id is None:
         logger.info("No run_id provided, fetching latest Staging model...")
         incoming_run_id, incoming_version = get_staging_run_info(client, model_name)
+        incoming_stage = "Staging"
         logger.info(f"Using Staging model version {incoming_version}, run_id: {incoming_run_id}")
+    else:
+        incoming_version, incoming_stage = get_model_version_for_run(client, model_name, incoming_run_id)
 
-    incoming_metrics = get_latest_metrics_for_run(client, incoming_run_id)
     prod_run_id, prod_version = get_production_run_info(client, model_name)
-    prod_metrics = get_latest_metrics_for_run(client, prod_run_id)
+    run_metrics = get_latest_metrics_for_runs(client, [incoming_run_id, prod_run_id])
+    incoming_metrics = run_metrics[incoming_run_id]
+    prod_metrics = run_metrics[prod_run_id]
 
     logger.info(f"\n### Incoming run_id: {incoming_run_id}")
     logger.info(f"### Production model version: {prod_version}, run_id: {prod_run_id}")
@@ -170,20 +173,17 @@ def evaluate_pipeline(
     )
     
     if should_promote:
-        new_prod_version = promote_model_to_production(client, incoming_run_id, model_name, prod_version)
+        new_prod_version = promote_model_to_production(
+            client, incoming_run_id, incoming_version, model_name, prod_version
+        )
         logger.info(f"New production version: {new_prod_version}")
     else:
         logger.info(f"Keeping version {prod_version} in production.")
         # If incoming model was from staging, archive it since it's not being promoted
-        if incoming_run_id is not None:
+        if incoming_stage == "Staging":
             logger.info(f"Archiving model in staging.")
             try:
-                # Get the version number for the incoming run_id
-                all_versions = client.search_model_versions(f"name='{model_name}'")
-                for mv in all_versions:
-                    if mv.run_id == incoming_run_id and mv.current_stage == "Staging":
-                        archive_non_production_model(client, model_name, mv.version)
-                        break
+                archive_non_production_model(client, model_name, incoming_version)
             except Exception as e:
                 logger.warning(f"Could not archive incoming model: {e}")
 
@@ -5,9 +5,9 @@ Run with: python run_all.py
 This will start all flows with their schedules in a single process.
 """
 from prefect import serve
-from flows.daily_upload import daily_batch_upload
-from flows.weekly_data_ingest_and_drift import weekly_ingestion_pipeline
-from flows.evaluate_pipeline import evaluate_pipeline
+# Flow modules are imported inside main() next to the deployment that uses
+# them, so only the dependencies (mlflow, prefect_aws, scipy...) of the
+# flows actually being deployed get imported.
 # from flows.training_pipeline import sagemaker_training_pipeline
 
 
@@ -26,6 +26,7 @@ def main():
     print("="*60 + "\n")
     
     # Deployment 1
+    # from flows.daily_upload import daily_batch_upload
     # deployment = daily_batch_upload.from_source(
     #     source="https://github.com/mscac-csc2701-fa25/prefect_flows.git",
     #     entrypoint="flows/daily_upload.py:daily_batch_upload"
@@ -39,6 +40,7 @@ def main():
     # print("Deployments created:", deployment)  
     
     # Deployment 2
+    from flows.weekly_data_ingest_and_drift import weekly_ingestion_pipeline
     deployment = weekly_ingestion_pipeline.from_source(
         source="https://github.com/mscac-csc2701-fa25/prefect_flows.git",
         entrypoint="flows/weekly_data_ingest_and_drift.py:weekly_ingestion_pipeline"
@@ -46,12 +48,13 @@ def main():
         name="weekly_ingestion_pipeline",
         work_pool_name="my-ec2-process-pool",
         cron="0 2 * * 0",  # Sundays at 2 AM UTC
-        job_variables={"pip_packages": ["prefect-aws", "scipy", "pillow", "numpy"]}
+        job_variables={"pip_packages": ["prefect-aws", "scipy", "pillow", "numpy", "pandas", "pyarrow"]}
     )
 
     print("Deployments created:", deployment)  
 
     # Deployment 3
+    # from flows.evaluate_pipeline import evaluate_pipeline
     # deployment = evaluate_pipeline.from_source(
     #     source="https://github.com/mscac-csc2701-fa25/prefect_flows.git",
     #     entrypoint="flows/evaluate_pipeline.py:evaluate_pipeline"
@@ -8,25 +8,8 @@ from prefect import serve
 # from flows.daily_upload import daily_batch_upload
 # from flows.weekly_pipeline import weekly_ml_pipeline
 # from flows.training_pipeline import sagemaker_training_pipeline
-from prefect import flow
-from pathlib import Path
 
 
-@flow(name="test1", log_prints=True)
-def test1():
-    print("Test1")
-    return {
-        "status": "okay"
-    }
-
-@flow(name="test2", log_prints=True)
-def test2():
-    print("gonna update some stuff")
-    print("TEST2")
-    return {
-        "status": "fail"
-    }
-
 def main():
     """Start all flows with their schedules"""
     
@@ -41,9 +24,10 @@ def main():
     print("Press Ctrl+C to stop all flows")
     print("="*60 + "\n")
     
+    from flows.smoke_test_flows import test2
     deployment = test2.from_source(
         source="https://github.com/mscac-csc2701-fa25/prefect_flows.git",
-        entrypoint="flows/run_all_2.py:test2"
+        entrypoint="flows/smoke_test_flows.py:test2"
     ).deploy(
         name="test_2",
         work_pool_name="my-ec2-process-pool",
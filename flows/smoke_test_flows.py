@@ -0,0 +1,20 @@
+"""
+Minimal flows for checking that deployments reach the work pool
+"""
+from prefect import flow
+
+
+@flow(name="test1", log_prints=True)
+def test1():
+    print("Test1")
+    return {
+        "status": "okay"
+    }
+
+@flow(name="test2", log_prints=True)
+def test2():
+    print("gonna update some stuff")
+    print("TEST2")
+    return {
+        "status": "fail"
+    }
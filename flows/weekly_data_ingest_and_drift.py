@@ -2,172 +2,350 @@
 Weekly ML pipeline - preprocess new data and check for drift
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from pathlib import Path
+from botocore.exceptions import ClientError
 from prefect import flow, task
+from prefect.task_runners import ThreadPoolTaskRunner
 
-from prefect_aws import AwsCredentials
-from config import BUCKET, INCOMING_PREFIX, PROCESSED_PREFIX
+from aws import (
+    IMAGE_EXTENSIONS,
+    LIST_PAGE_SIZE,
+    MAX_WORKERS,
+    copy_key,
+    delete_keys,
+    get_s3_client
+)
+from config import BUCKET, INCOMING_MANIFEST_PREFIX, INCOMING_PREFIX, PROCESSED_PREFIX
 
-from scipy.stats import ks_2samp
+from scipy.stats import kstwo, wasserstein_distance
 from PIL import Image
 import io
+import json
 import numpy as np
+import pandas as pd
 import random
 
-@task(retries=1)
-def get_batch_folders():
-    """Find all batch_ folders in incoming/raw"""
-    aws_credentials = AwsCredentials.load("my-aws-creds")
-    session = aws_credentials.get_boto3_session()
-    s3 = session.client("s3")
+BASELINE_PREFIX = 'datasets/baseline/train/'
+# Versioned with get_image_properties, so stale statistics are never compared
+BASELINE_STATS_KEY = 'datasets/baseline/train_stats_v2.parquet'
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+THUMBNAIL_SIZE = (256, 256)
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+DRIFT_WORKERS = 32  # Leaves client connections for ranged GETs of large images
+DRIFT_PROPERTIES = ('brightness', 'contrast', 'r_mean', 'g_mean', 'b_mean')
+
+
+def copy_small_key(s3, source_key, dest_key):
+    """Single-request server-side copy, skipping the HeadObject that copy() sends first"""
+    s3.copy_object(
+        Bucket=BUCKET,
+        Key=dest_key,
+        CopySource={'Bucket': BUCKET, 'Key': source_key}
+    )
+
+
+def download_concurrent(s3, key, chunk_size=DOWNLOAD_CHUNK_SIZE, concurrency=16):
+    """Download an object, fetching its byte ranges in parallel when it spans several chunks"""
+    # The first ranged GET also reports the object size, so no HeadObject is needed
+    first = s3.get_object(Bucket=BUCKET, Key=key, Range=f'bytes=0-{chunk_size - 1}')
+    size = int(first['ContentRange'].rsplit('/', 1)[1])
+    head = first['Body'].read()
+    if size <= chunk_size:
+        return head
+    
+    ranges = [
+        (start, min(start + chunk_size, size))
+        for start in range(chunk_size, size, chunk_size)
+    ]
+    
+    def _get_range(byte_range):
+        start, end = byte_range
+        response = s3.get_object(Bucket=BUCKET, Key=key, Range=f'bytes={start}-{end - 1}')
+        return response['Body'].read()
+    
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        parts = list(executor.map(_get_range, ranges))
     
-    # List all objects under incoming/raw/
-    response = s3.list_objects_v2(
+    return b''.join([head, *parts])
+
+
+def iter_keys(s3, prefix):
+    """Yield every object key under prefix, skipping folder markers"""
+    paginator = s3.get_paginator('list_objects_v2')
+    pages = paginator.paginate(
+        Bucket=BUCKET,
+        Prefix=prefix,
+        PaginationConfig={'PageSize': LIST_PAGE_SIZE}
+    )
+    for page in pages:
+        for obj in page.get('Contents', []):
+            if not obj['Key'].endswith('/'):
+                yield obj['Key']
+
+
+def iter_folders(s3, prefix):
+    """Yield the immediate sub-folders of prefix"""
+    paginator = s3.get_paginator('list_objects_v2')
+    pages = paginator.paginate(
         Bucket=BUCKET,
-        Prefix=INCOMING_PREFIX,
-        Delimiter='/'
+        Prefix=prefix,
+        Delimiter='/',
+        PaginationConfig={'PageSize': LIST_PAGE_SIZE}
     )
+    for page in pages:
+        for common_prefix in page.get('CommonPrefixes', []):
+            yield common_prefix['Prefix']
+
+
+def reservoir_sample(items, k):
+    """Uniformly sample up to k items from a stream in one pass (Algorithm R)"""
+    reservoir = []
+    for i, item in enumerate(items):
+        if i < k:
+            reservoir.append(item)
+        else:
+            j = random.randrange(i + 1)
+            if j < k:
+                reservoir[j] = item
+    return reservoir
+
+
+def ks_2samp_asymp(x, y):
+    """Two-sample KS statistic and asymptotic p-value, as ks_2samp(method='asymp')
+
+    Evaluates both ECDFs at every pooled sample with searchsorted, skipping
+    scipy's per-call argument handling and mode selection.
+    """
+    xs = np.sort(x)
+    ys = np.sort(y)
+    pooled = np.concatenate([xs, ys])
+    cdf_x = np.searchsorted(xs, pooled, side='right') / len(xs)
+    cdf_y = np.searchsorted(ys, pooled, side='right') / len(ys)
+    statistic = float(np.max(np.abs(cdf_x - cdf_y)))
+    en = len(xs) * len(ys) / (len(xs) + len(ys))
+    pvalue = float(np.clip(kstwo.sf(statistic, np.round(en)), 0, 1))
+    return statistic, pvalue
+
+
+def channel_histogram(rgb):
+    """Per-channel 256-bin histogram of an 8-bit RGB image, shape (3, 256)"""
+    flat = rgb.reshape(-1, 3)
+    return np.stack([np.bincount(flat[:, c], minlength=256) for c in range(3)])
+
+
+def batch_hist(histograms):
+    """Pool per-image channel histograms into one (3, 256) histogram"""
+    return np.stack(histograms).sum(axis=0)
+
+
+@task
+def get_batch_folders():
+    """Find all incoming batches: sharded batch manifests and unsharded batch_ folders in incoming/raw"""
+    s3 = get_s3_client()
     
-    if 'CommonPrefixes' not in response:
-        return []
+    # Sharded batches are enumerated from their manifests, with no cross-shard LIST
+    manifests = [
+        key for key in iter_keys(s3, INCOMING_MANIFEST_PREFIX)
+        if key.endswith('.json')
+    ]
     
-    # Filter for batch_ prefixes
+    # List all folders under incoming/raw/ and filter for batch_ prefixes
     batch_folders = [
-        prefix['Prefix'] for prefix in response['CommonPrefixes']
-        if 'batch_' in prefix['Prefix']
+        prefix for prefix in iter_folders(s3, INCOMING_PREFIX)
+        if prefix.rstrip('/').rsplit('/', 1)[-1].startswith('batch_')
     ]
     
-    return batch_folders
+    return manifests + batch_folders
 
 
-@task(retries=1)
-def get_files_from_batches(batch_folders):
-    """Get all images and labels from batch folders"""
-    aws_credentials = AwsCredentials.load("my-aws-creds")
-    session = aws_credentials.get_boto3_session()
-    s3 = session.client("s3")
+@task
+def list_one_batch(batch_folder):
+    """Get all images and labels from a single batch manifest or folder"""
+    s3 = get_s3_client()
+    
+    if batch_folder.startswith(INCOMING_MANIFEST_PREFIX):
+        try:
+            body = s3.get_object(Bucket=BUCKET, Key=batch_folder)['Body'].read()
+        except s3.exceptions.NoSuchKey:
+            # Already consumed by an earlier run
+            return [], []
+        manifest = json.loads(body)
+        return manifest['images'], manifest['labels']
     
     images = []
     labels = []
     
-    for batch_folder in batch_folders:
-        # Get images
-        img_response = s3.list_objects_v2(
-            Bucket=BUCKET,
-            Prefix=f'{batch_folder}images/'
-        )
-        if 'Contents' in img_response:
-            images.extend([
-                obj['Key'] for obj in img_response['Contents']
-                if not obj['Key'].endswith('/')
-            ])
-        
-        # Get labels
-        lbl_response = s3.list_objects_v2(
-            Bucket=BUCKET,
-            Prefix=f'{batch_folder}labels/'
-        )
-        if 'Contents' in lbl_response:
-            labels.extend([
-                obj['Key'] for obj in lbl_response['Contents']
-                if not obj['Key'].endswith('/')
-            ])
+    # One listing for the whole folder, classified by sub-folder
+    for key in iter_keys(s3, batch_folder):
+        if key.startswith('images/', len(batch_folder)):
+            images.append(key)
+        elif key.startswith('labels/', len(batch_folder)):
+            labels.append(key)
     
     return images, labels
 
 
-@task(retries=2)
-def preprocess_and_move(images, labels):
-    """Preprocess images/labels and move to weekly_batch folder"""
+@task
+def preprocess_and_move(images, labels, manifests=()):
+    """Preprocess images/labels and move to weekly_batch folder
+
+    Sources are deleted only once their copy has succeeded, so anything that
+    fails stays in incoming/raw and is picked up by the next run. The batch
+    manifests are consumed; failed sharded files go into a retry manifest.
+    Returns ({'images': [...], 'labels': [...]}, weekly_batch_prefix).
+    """
     if not images:
-        return []
+        return {'images': [], 'labels': []}, None
     
-    aws_credentials = AwsCredentials.load("my-aws-creds")
-    session = aws_credentials.get_boto3_session()
-    s3 = session.client("s3")
+    s3 = get_s3_client()
     
     # Create timestamped weekly batch folder
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     weekly_batch_prefix = f'{PROCESSED_PREFIX}weekly_batch_{timestamp}/'
     
-    processed_files = []
+    # TODO: Implement actual preprocessing
+    # - Download image
+    # - Resize, normalize, etc.
+    # - Extract features for drift detection
+    jobs = [
+        ('image', key, f"{weekly_batch_prefix}images/{key.rsplit('/', 1)[-1]}")
+        for key in images
+    ] + [
+        ('label', key, f"{weekly_batch_prefix}labels/{key.rsplit('/', 1)[-1]}")
+        for key in labels
+    ]
     
-    # Process images
-    for img_key in images:
-        try:
-            filename = Path(img_key).name
-            
-            # TODO: Implement actual preprocessing
-            # - Download image
-            # - Resize, normalize, etc.
-            # - Extract features for drift detection
-            
-            new_key = f'{weekly_batch_prefix}images/{filename}'
-            
-            s3.copy_object(
-                Bucket=BUCKET,
-                CopySource={'Bucket': BUCKET, 'Key': img_key},
-                Key=new_key
-            )
-            
-            processed_files.append(new_key)
-            
-        except Exception as e:
-            print(f"Error processing image {Path(img_key).name}: {e}")
-            continue
+    # Copies are independent server-side calls, so run them concurrently.
+    # Labels are tiny text files and never need more than one CopyObject.
+    copiers = {'image': copy_key, 'label': copy_small_key}
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = [
+            (executor.submit(copiers[kind], s3, source, new_key), kind, source, new_key)
+            for kind, source, new_key in jobs
+        ]
     
-    # Process labels
-    for lbl_key in labels:
-        try:
-            filename = Path(lbl_key).name
-            
-            new_key = f'{weekly_batch_prefix}labels/{filename}'
-            
-            s3.copy_object(
-                Bucket=BUCKET,
-                CopySource={'Bucket': BUCKET, 'Key': lbl_key},
-                Key=new_key
+    # Failures are collected per copy; the rest of the batch still goes through
+    processed_files = {'images': [], 'labels': []}
+    moved_sources = []
+    retry = {'images': [], 'labels': []}
+    for future, kind, source, new_key in futures:
+        error = future.exception()
+        if error is not None:
+            print(f"Error processing {kind} {source.rsplit('/', 1)[-1]}: {error}")
+            # Unsharded batch_ folders are found by listing, and a missing
+            # source has nothing left to move; everything else needs a manifest
+            missing = (
+                isinstance(error, ClientError)
+                and error.response['Error']['Code'] in ('404', 'NoSuchKey')
             )
-            
-            processed_files.append(new_key)
-            
-        except Exception as e:
-            print(f"Error processing label {Path(lbl_key).name}: {e}")
+            if not missing and not source.startswith(f'{INCOMING_PREFIX}batch_'):
+                retry[f'{kind}s'].append(source)
             continue
+        processed_files[f'{kind}s'].append(new_key)
+        moved_sources.append({'Key': source})
+    
+    if retry['images'] or retry['labels']:
+        s3.put_object(
+            Bucket=BUCKET,
+            Key=f'{INCOMING_MANIFEST_PREFIX}batch_retry_{timestamp}.json',
+            Body=json.dumps(retry).encode(),
+            ContentType='application/json'
+        )
+    
+    # Remove the originals in the same pass instead of re-listing the batch folders
+    delete_keys(s3, moved_sources + [{'Key': key} for key in manifests])
+    print(f"Removed {len(moved_sources)} source files from {INCOMING_PREFIX}")
     
     return processed_files, weekly_batch_prefix
 
 
-@task(retries=1)
-def cleanup_batch_folders(batch_folders):
-    """Delete processed batch folders from incoming/raw"""
-    aws_credentials = AwsCredentials.load("my-aws-creds")
-    session = aws_credentials.get_boto3_session()
-    s3 = session.client("s3")
-    
-    for batch_folder in batch_folders:
-        # List all objects in the batch folder
-        response = s3.list_objects_v2(
-            Bucket=BUCKET,
-            Prefix=batch_folder
-        )
-        
-        if 'Contents' in response:
-            # Delete all objects
-            objects_to_delete = [{'Key': obj['Key']} for obj in response['Contents']]
-            if objects_to_delete:
-                s3.delete_objects(
-                    Bucket=BUCKET,
-                    Delete={'Objects': objects_to_delete}
-                )
+def get_image_properties(s3, s3_key):
+    """Load an image and return its DRIFT_PROPERTIES vector and channel histogram"""
+    img = Image.open(io.BytesIO(download_concurrent(s3, s3_key)))
+    # Statistics are taken on a downsampled copy: per-image means and
+    # spreads barely move. Drafting at the thumbnail size lets libjpeg-turbo
+    # decode JPEGs at up to 1/8 scale in the DCT, so most pixels are never built
+    img.draft('RGB', THUMBNAIL_SIZE)
+    # Resampling only supports 8-bit modes, so 16/32-bit and other modes
+    # (RGBA, palette, ...) are normalised first
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    img.thumbnail(THUMBNAIL_SIZE, Image.Resampling.BILINEAR)
+    pixels = np.asarray(img)
+    arr = pixels.astype(np.float32)
+    
+    # Brightness and contrast are the mean and spread of CIE luma
+    # (0.299R + 0.587G + 0.114B), which one matrix-vector product yields
+    if img.mode == 'RGB':
+        flat = arr.reshape(-1, 3)
+        r_mean, g_mean, b_mean = flat.mean(axis=0)
+        luma = flat @ LUMA_WEIGHTS
+        brightness = luma.mean()
+        contrast = luma.std()
+        rgb = pixels
+    else:  # Grayscale
+        brightness = arr.mean()
+        contrast = arr.std()
+        r_mean = g_mean = b_mean = brightness
+        rgb = np.asarray(img.convert('RGB'))
+    
+    # Features follow DRIFT_PROPERTIES order
+    features = np.array(
+        [brightness, contrast, r_mean, g_mean, b_mean],
+        dtype=np.float32
+    )
+    return features, channel_histogram(rgb)
+
+
+def load_baseline_stats(s3):
+    """Read the precomputed baseline statistics, or None if they have not been built"""
+    try:
+        response = s3.get_object(Bucket=BUCKET, Key=BASELINE_STATS_KEY)
+    except s3.exceptions.NoSuchKey:
+        return None
+    return pd.read_parquet(io.BytesIO(response['Body'].read()))
+
+
+@task
+def compute_baseline_stats():
+    """Precompute per-image baseline statistics so drift runs skip the downloads"""
+    s3 = get_s3_client()
+    
+    baseline_images = [
+        key for key in iter_keys(s3, BASELINE_PREFIX)
+        if key.lower().endswith(IMAGE_EXTENSIONS)
+    ]
+    print(f"Extracting properties from {len(baseline_images)} baseline images...")
     
-    print(f"Cleaned up {len(batch_folders)} batch folders")
+    with ThreadPoolExecutor(max_workers=DRIFT_WORKERS) as executor:
+        results = list(executor.map(
+            lambda key: get_image_properties(s3, key), baseline_images
+        ))
+    
+    stats = pd.DataFrame(
+        [features for features, _ in results],
+        columns=list(DRIFT_PROPERTIES)
+    )
+    stats.insert(0, 'key', baseline_images)
+    # Histograms are stored flattened so the Wasserstein comparison still works
+    stats['hist'] = [hist.ravel() for _, hist in results]
+    
+    buffer = io.BytesIO()
+    stats.to_parquet(buffer, index=False)
+    s3.put_object(Bucket=BUCKET, Key=BASELINE_STATS_KEY, Body=buffer.getvalue())
+    print(f"Wrote statistics for {len(stats)} images to {BASELINE_STATS_KEY}")
+    return len(stats)
 
 
 @task(retries=1)
 def detect_drift(processed_files, override_drift):
-    """Check if drift detected in new data"""
+    """Check if drift detected in new data
+
+    Returns (drift_detected, score). KS testing stops at the first property
+    with p < 0.05, so the score averages a varying subset of properties and
+    is not comparable from week to week.
+    """
     
     # Handle override for testing
     if override_drift is True:
@@ -176,90 +354,86 @@ def detect_drift(processed_files, override_drift):
         return (False, 0.32)
     
     # Minimum threshold - need at least 30 images to do meaningful drift detection
-    num_images = len([f for f in processed_files if '/images/' in f])
+    weekly_images = processed_files['images']
+    num_images = len(weekly_images)
     if num_images < 30:
         print(f"Only {num_images} images - skipping drift detection (minimum 30 required)")
         return (False, 0.0)
     
-    aws_credentials = AwsCredentials.load("my-aws-creds")
-    session = aws_credentials.get_boto3_session()
-    s3 = session.client("s3")
+    s3 = get_s3_client()
     
     try:
         
-        # Get baseline (training) images - sample same number as weekly batch
-        baseline_response = s3.list_objects_v2(
-            Bucket=BUCKET,
-            Prefix='datasets/baseline/train/'
-        )
-        
-        if 'Contents' not in baseline_response:
-            print("No baseline images found")
-            return (False, 0.0)
-        
-        baseline_images = [
-            obj['Key'] for obj in baseline_response['Contents'] 
-            if obj['Key'].lower().endswith(('.jpg', '.jpeg', '.png'))
-        ]
-        
-        # Random sample from baseline to match weekly batch size
-        if len(baseline_images) > num_images:
-            baseline_sample = random.sample(baseline_images, num_images)
-        else:
-            baseline_sample = baseline_images
-        
-        # Helper function to load image and extract properties
-        def get_image_properties(s3_key):
-            obj = s3.get_object(Bucket=BUCKET, Key=s3_key)
-            img = Image.open(io.BytesIO(obj['Body'].read()))
-            arr = np.array(img)
-            
-            # Calculate basic properties
-            brightness = arr.mean()
-            contrast = arr.std()
-            
-            if len(arr.shape) == 3 and arr.shape[2] == 3:  # RGB
-                r_mean = arr[:,:,0].mean()
-                g_mean = arr[:,:,1].mean()
-                b_mean = arr[:,:,2].mean()
-            else:  # Grayscale
-                r_mean = g_mean = b_mean = brightness
+        # Downloads are latency-bound, so overlap them (and the decodes) in a pool
+        with ThreadPoolExecutor(max_workers=DRIFT_WORKERS) as executor:
+            baseline_stats = load_baseline_stats(s3)
+            if baseline_stats is not None and len(baseline_stats):
+                # The baseline is stable, so sample its precomputed rows instead
+                sample = baseline_stats.sample(n=min(num_images, len(baseline_stats)))
+                print(f"Using precomputed properties of {len(sample)} baseline images")
+                baseline_features = sample[list(DRIFT_PROPERTIES)].to_numpy(np.float32)
+                baseline_hists = [np.asarray(h).reshape(3, 256) for h in sample['hist']]
+            else:
+                # Sample baseline (training) images straight off the listing,
+                # the same number as the weekly batch
+                baseline_sample = reservoir_sample(
+                    (
+                        key for key in iter_keys(s3, BASELINE_PREFIX)
+                        if key.lower().endswith(IMAGE_EXTENSIONS)
+                    ),
+                    num_images
+                )
+                
+                if not baseline_sample:
+                    print("No baseline images found")
+                    return (False, 0.0)
+                
+                # Extract properties from baseline
+                print(f"Extracting properties from {len(baseline_sample)} baseline images...")
+                baseline_features, baseline_hists = zip(*executor.map(
+                    lambda key: get_image_properties(s3, key), baseline_sample
+                ))
             
-            return {
-                'brightness': brightness,
-                'contrast': contrast,
-                'r_mean': r_mean,
-                'g_mean': g_mean,
-                'b_mean': b_mean
-            }
+            # Extract properties from weekly batch
+            print(f"Extracting properties from {len(weekly_images)} weekly images...")
+            weekly_features, weekly_hists = zip(*executor.map(
+                lambda key: get_image_properties(s3, key), weekly_images
+            ))
         
-        # Extract properties from baseline
-        print(f"Extracting properties from {len(baseline_sample)} baseline images...")
-        baseline_props = [get_image_properties(key) for key in baseline_sample]
+        # One (n, properties) matrix per side; KS runs column by column
+        base = np.stack(baseline_features)
+        week = np.stack(weekly_features)
         
-        # Extract properties from weekly batch
-        weekly_images = [f for f in processed_files if '/images/' in f]
-        print(f"Extracting properties from {len(weekly_images)} weekly images...")
-        weekly_props = [get_image_properties(key) for key in weekly_images]
-        
-        # Perform KS test on each property
+        # Perform KS test on each property; the asymptotic p-value avoids
+        # the exact-distribution path, which is the slow one at these sizes
+        # The decision is "any p < 0.05", so stop at the first significant
+        # property (tested in DRIFT_PROPERTIES order)
         drift_scores = {}
-        for prop in ['brightness', 'contrast', 'r_mean', 'g_mean', 'b_mean']:
-            baseline_vals = [p[prop] for p in baseline_props]
-            weekly_vals = [p[prop] for p in weekly_props]
-            
-            statistic, pvalue = ks_2samp(baseline_vals, weekly_vals)
+        significant_drift = False
+        for i, prop in enumerate(DRIFT_PROPERTIES):
+            statistic, pvalue = ks_2samp_asymp(base[:, i], week[:, i])
             drift_scores[prop] = {'statistic': statistic, 'pvalue': pvalue}
+            if pvalue < 0.05:
+                significant_drift = True
+                break
         
-        # Calculate overall drift score (average KS statistic)
+        # Calculate overall drift score (average KS statistic of the tests run)
         avg_drift_score = np.mean([s['statistic'] for s in drift_scores.values()])
         
-        # Check if any property shows significant drift (p < 0.05)
-        significant_drift = any(s['pvalue'] < 0.05 for s in drift_scores.values())
+        # Compare pooled colour distributions with the earth mover's distance
+        baseline_hist = batch_hist(baseline_hists)
+        weekly_hist = batch_hist(weekly_hists)
+        bins = np.arange(256)
+        hist_distances = {
+            channel: wasserstein_distance(bins, bins, baseline_hist[i], weekly_hist[i])
+            for i, channel in enumerate(('r', 'g', 'b'))
+        }
         
         print(f"Drift analysis:")
         for prop, scores in drift_scores.items():
             print(f"  {prop}: KS={scores['statistic']:.4f}, p={scores['pvalue']:.4f}")
+        for channel, distance in hist_distances.items():
+            print(f"  {channel}_hist: W1={distance:.4f}")
         
         # Drift detected if p-value < 0.05 for any property
         drift_detected = significant_drift
@@ -330,51 +504,35 @@ def trigger_sagemaker_job(trigger_reason, epochs):
 
 
 
-@task(retries=1)
+@task
 def get_existing_processed_files():
     """Get all images from existing weekly_batch folders in processed/"""
-    aws_credentials = AwsCredentials.load("my-aws-creds")
-    session = aws_credentials.get_boto3_session()
-    s3 = session.client("s3")
+    s3 = get_s3_client()
     
-    # List all folders under processed/
-    response = s3.list_objects_v2(
-        Bucket=BUCKET,
-        Prefix=PROCESSED_PREFIX,
-        Delimiter='/'
-    )
-    
-    if 'CommonPrefixes' not in response:
-        return []
-    
-    # Filter for weekly_batch_ prefixes
+    # List all folders under processed/ and filter for weekly_batch_ prefixes
     weekly_batch_folders = [
-        prefix['Prefix'] for prefix in response['CommonPrefixes']
-        if 'weekly_batch_' in prefix['Prefix']
+        prefix for prefix in iter_folders(s3, PROCESSED_PREFIX)
+        if prefix.rstrip('/').rsplit('/', 1)[-1].startswith('weekly_batch_')
     ]
     
     if not weekly_batch_folders:
         print("No existing weekly_batch folders found")
-        return []
+        return {'images': [], 'labels': []}
     
-    # Get all images from all weekly_batch folders
-    all_images = []
-    for folder in weekly_batch_folders:
-        img_response = s3.list_objects_v2(
-            Bucket=BUCKET,
-            Prefix=f'{folder}images/'
+    # Get all images from all weekly_batch folders, listing folders concurrently
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        listings = executor.map(
+            lambda folder: list(iter_keys(s3, f'{folder}images/')),
+            weekly_batch_folders
         )
-        if 'Contents' in img_response:
-            all_images.extend([
-                obj['Key'] for obj in img_response['Contents']
-                if not obj['Key'].endswith('/')
-            ])
+        all_images = [key for listing in listings for key in listing]
     
     print(f"Found {len(all_images)} images across {len(weekly_batch_folders)} weekly_batch folders")
-    return all_images
+    return {'images': all_images, 'labels': []}
 
 
-@flow(log_prints=True)
+# Bound mapped S3 tasks (list_one_batch) to the client's connection pool
+@flow(log_prints=True, task_runner=ThreadPoolTaskRunner(max_workers=MAX_WORKERS))
 def weekly_ingestion_pipeline(override_drift: bool | None = None, use_existing_processed: bool = False):
     """Check for new data, preprocess, detect drift, retrain if needed"""
     
@@ -382,7 +540,7 @@ def weekly_ingestion_pipeline(override_drift: bool | None = None, use_existing_p
         print("Using existing processed files for testing...")
         processed_files = get_existing_processed_files()
         
-        if not processed_files:
+        if not processed_files['images']:
             print("No existing processed files found")
             return {"status": "no_existing_data"}
         
@@ -401,7 +559,7 @@ def weekly_ingestion_pipeline(override_drift: bool | None = None, use_existing_p
                 "status": "test_run_retrained",
                 "drift_detected": drift_detected,
                 "drift_score": drift_score,
-                "processed": len([f for f in processed_files if '/images/' in f]),
+                "processed": len(processed_files['images']),
                 "training_result": training_result
             }
         else:
@@ -410,7 +568,7 @@ def weekly_ingestion_pipeline(override_drift: bool | None = None, use_existing_p
                 "status": "test_run_no_drift",
                 "drift_detected": drift_detected,
                 "drift_score": drift_score,
-                "processed": len([f for f in processed_files if '/images/' in f])
+                "processed": len(processed_files['images'])
             }
     
     # Normal flow continues
@@ -423,7 +581,10 @@ def weekly_ingestion_pipeline(override_drift: bool | None = None, use_existing_p
     print(f"Found {len(batch_folders)} batch folders")
     
     # Get all images and labels from batches
-    images, labels = get_files_from_batches(batch_folders)
+    # List batch folders concurrently on the flow's task runner
+    batch_listings = list_one_batch.map(batch_folders).result()
+    images = [key for batch_images, _ in batch_listings for key in batch_images]
+    labels = [key for _, batch_labels in batch_listings for key in batch_labels]
     print(f"Found {len(images)} images and {len(labels)} labels")
     
     if not images:
@@ -431,11 +592,10 @@ def weekly_ingestion_pipeline(override_drift: bool | None = None, use_existing_p
         return {"status": "no_new_data"}
     
     # Preprocess and move to weekly_batch folder
-    processed_files, weekly_batch_prefix = preprocess_and_move(images, labels)
-    print(f"Processed {len(processed_files)} files to {weekly_batch_prefix}")
-    
-    # Clean up original batch folders
-    cleanup_batch_folders(batch_folders)
+    manifests = [b for b in batch_folders if b.startswith(INCOMING_MANIFEST_PREFIX)]
+    processed_files, weekly_batch_prefix = preprocess_and_move(images, labels, manifests)
+    num_processed = len(processed_files['images']) + len(processed_files['labels'])
+    print(f"Processed {num_processed} files to {weekly_batch_prefix}")
     
     # Check drift with actual processed data
     drift_detected, drift_score = detect_drift(processed_files, override_drift)
@@ -451,7 +611,7 @@ def weekly_ingestion_pipeline(override_drift: bool | None = None, use_existing_p
         return {
             "status": "retrained",
             "drift_score": drift_score,
-            "processed": len(images),
+            "processed": len(processed_files['images']),
             "weekly_batch": weekly_batch_prefix,
             "training_result": training_result
         }
@@ -460,9 +620,22 @@ def weekly_ingestion_pipeline(override_drift: bool | None = None, use_existing_p
         return {
             "status": "no_retrain_needed",
             "drift_score": drift_score,
-            "processed": len(images),
+            "processed": len(processed_files['images']),
             "weekly_batch": weekly_batch_prefix
         }
 
+
+@flow(log_prints=True)
+def build_baseline_stats():
+    """One-shot refresh of the baseline statistics used by detect_drift"""
+    count = compute_baseline_stats()
+    return {"status": "success", "images": count}
+
+
 if __name__ == "__main__":
-    weekly_ingestion_pipeline()
\ No newline at end of file
+    import sys
+    
+    if len(sys.argv) > 1 and sys.argv[1] == 'baseline-stats':
+        build_baseline_stats()
+    else:
+        weekly_ingestion_pipeline()
\ No newline at end of file
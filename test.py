@@ -4,40 +4,61 @@ Run with: python batch_upload.py serve
 """
 
 import boto3
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 from prefect import task, flow
 
-# Configuration
-BUCKET = 'smoke-fire-detection-bucket'
-BATCH_SIZE = 5
+from config import BATCH_SIZE, BUCKET
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# Enough pooled connections for the copy fan-out; back off on 503 SlowDown
+S3_CONFIG = Config(
+    max_pool_connections=64,
+    retries={'mode': 'adaptive', 'max_attempts': 10},
+    tcp_keepalive=True,
+    s3={'addressing_style': 'virtual'}
+)
+
+
+@lru_cache(maxsize=1)
+def get_s3_client():
+    """One S3 client per process, shared by every task (clients are thread-safe)"""
+    return boto3.client('s3', config=S3_CONFIG)
 
 
 @task(name="get-batch-images", retries=1)
 def get_available_images(limit=BATCH_SIZE):
     """Get the next batch of images from simulation pool"""
     print(f"🔍 Looking for {limit} images in simulation pool...")
-    s3 = boto3.client('s3')
+    s3 = get_s3_client()
     
-    response = s3.list_objects_v2(
+    paginator = s3.get_paginator('list_objects_v2')
+    pages = paginator.paginate(
         Bucket=BUCKET,
         Prefix='datasets/simulation_pool/images/',
-        MaxKeys=limit * 2  # Get extra in case some are folders
+        PaginationConfig={'PageSize': 1000}
     )
     
-    if 'Contents' not in response:
+    # Filter out folders, get actual image files; stop paging once we have enough
+    images = []
+    for page in pages:
+        for obj in page.get('Contents', []):
+            key = obj['Key']
+            if not key.endswith('/') and key.lower().endswith(IMAGE_EXTENSIONS):
+                images.append(key)
+                if len(images) >= limit:
+                    break
+        if len(images) >= limit:
+            break
+    
+    if not images:
         print("❌ No images found in simulation_pool/images/")
         return []
     
-    # Filter out folders, get actual image files
-    images = []
-    for obj in response['Contents']:
-        key = obj['Key']
-        if not key.endswith('/') and any(key.lower().endswith(ext) for ext in ['.jpg', '.jpeg', '.png']):
-            images.append(key)
-            if len(images) >= limit:
-                break
-    
     print(f"  ✅ Found {len(images)} images to move")
     return images
 
@@ -49,79 +70,107 @@ def move_batch_to_incoming(image_keys):
         print("⚠️  No images to move")
         return 0
     
-    s3 = boto3.client('s3')
+    s3 = get_s3_client()
     batch_date = datetime.now().strftime("%Y%m%d")
-    moved_count = 0
     
     print(f"\n📦 Moving batch to incoming/batch_{batch_date}/")
     
-    for image_key in image_keys:
+    def move_one(image_key):
+        image_name = Path(image_key).name
+        image_stem = Path(image_key).stem
+        
+        # New destinations with batch folder
+        new_image_key = f'datasets/incoming/batch_{batch_date}/images/{image_name}'
+        new_label_key = f'datasets/incoming/batch_{batch_date}/labels/{image_stem}.txt'
+        
+        # Move image
+        s3.copy_object(
+            Bucket=BUCKET,
+            CopySource={'Bucket': BUCKET, 'Key': image_key},
+            Key=new_image_key
+        )
+        to_delete = [{'Key': image_key}]
+        print(f"  ✓ Moved image: {image_name}")
+        
+        # Move label (if it exists)
+        label_key = image_key.replace('/images/', '/labels/')
+        for ext in ['.jpg', '.jpeg', '.png', '.JPG', '.JPEG', '.PNG']:
+            label_key = label_key.replace(ext, '.txt')
+        
         try:
-            image_name = Path(image_key).name
-            image_stem = Path(image_key).stem
-            
-            # New destinations with batch folder
-            new_image_key = f'datasets/incoming/batch_{batch_date}/images/{image_name}'
-            new_label_key = f'datasets/incoming/batch_{batch_date}/labels/{image_stem}.txt'
-            
-            # Move image
             s3.copy_object(
                 Bucket=BUCKET,
-                CopySource={'Bucket': BUCKET, 'Key': image_key},
-                Key=new_image_key
+                CopySource={'Bucket': BUCKET, 'Key': label_key},
+                Key=new_label_key
             )
-            s3.delete_object(Bucket=BUCKET, Key=image_key)
-            print(f"  ✓ Moved image: {image_name}")
-            
-            # Move label (if it exists)
-            label_key = image_key.replace('/images/', '/labels/')
-            for ext in ['.jpg', '.jpeg', '.png', '.JPG', '.JPEG', '.PNG']:
-                label_key = label_key.replace(ext, '.txt')
-            
-            try:
-                s3.copy_object(
-                    Bucket=BUCKET,
-                    CopySource={'Bucket': BUCKET, 'Key': label_key},
-                    Key=new_label_key
-                )
-                s3.delete_object(Bucket=BUCKET, Key=label_key)
-                print(f"    └─ Label: {image_stem}.txt")
-            except s3.exceptions.NoSuchKey:
-                print(f"    └─ (no label found)")
-            
-            moved_count += 1
-            
-        except Exception as e:
-            print(f"  ❌ Error moving {Path(image_key).name}: {e}")
-            continue
-    
-    return moved_count
+            to_delete.append({'Key': label_key})
+            print(f"    └─ Label: {image_stem}.txt")
+        except s3.exceptions.NoSuchKey:
+            print(f"    └─ (no label found)")
+        
+        return to_delete
+    
+    # Each move is independent, so issue them in parallel
+    with ThreadPoolExecutor(max_workers=64) as pool:
+        futures = {pool.submit(move_one, key): key for key in image_keys}
+    
+    moved = []
+    to_delete = []
+    for future, image_key in futures.items():
+        error = future.exception()
+        if error is not None:
+            print(f"  ❌ Error moving {Path(image_key).name}: {error}")
+        else:
+            to_delete.extend(future.result())
+            moved.append(image_key)
+    
+    # Remove the copied originals with batched deletes (1000 keys per request);
+    # quiet mode only reports the keys that failed
+    failed = set()
+    for i in range(0, len(to_delete), 1000):
+        response = s3.delete_objects(
+            Bucket=BUCKET,
+            Delete={'Objects': to_delete[i:i + 1000], 'Quiet': True}
+        )
+        for error in response.get('Errors', []):
+            print(f"  ❌ Error deleting {error['Key']}: {error.get('Message')}")
+            failed.add(error['Key'])
+    
+    # An image still in the pool was copied, not moved
+    return sum(1 for key in moved if key not in failed)
 
 
 @task(name="count-stats")
 def get_stats():
     """Get counts from both folders"""
-    s3 = boto3.client('s3')
+    s3 = get_s3_client()
+    paginator = s3.get_paginator('list_objects_v2')
     
     # Count remaining in simulation pool
     try:
-        response = s3.list_objects_v2(
+        pages = paginator.paginate(
             Bucket=BUCKET,
-            Prefix='datasets/simulation_pool/images/'
+            Prefix='datasets/simulation_pool/images/',
+            PaginationConfig={'PageSize': 1000}
+        )
+        pool_count = sum(
+            1 for page in pages for obj in page.get('Contents', [])
+            if not obj['Key'].endswith('/')
         )
-        pool_count = len([obj for obj in response.get('Contents', []) 
-                         if not obj['Key'].endswith('/')])
     except:
         pool_count = 0
     
     # Count in incoming
     try:
-        response = s3.list_objects_v2(
+        pages = paginator.paginate(
             Bucket=BUCKET,
-            Prefix='datasets/incoming/'
+            Prefix='datasets/incoming/',
+            PaginationConfig={'PageSize': 1000}
+        )
+        incoming_count = sum(
+            1 for page in pages for obj in page.get('Contents', [])
+            if not obj['Key'].endswith('/') and 'images/' in obj['Key']
         )
-        incoming_count = len([obj for obj in response.get('Contents', []) 
-                             if not obj['Key'].endswith('/') and 'images/' in obj['Key']])
     except:
         incoming_count = 0
     